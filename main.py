@@ -1,12 +1,22 @@
 # main.py
 import os
-from typing import Any, Dict, List, Optional
+import asyncio
+import time
+import functools
+import hmac
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Final, List, Optional, Tuple
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Query, HTTPException
+import orjson
+from typing_extensions import LiteralString
+
+from fastapi import FastAPI, Header, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from neo4j import GraphDatabase
-from neo4j.exceptions import Neo4jError
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel
+from neo4j import READ_ACCESS, AsyncGraphDatabase, Record, RoutingControl
+from neo4j.exceptions import Neo4jError, ServiceUnavailable, SessionExpired
 
 # ----------------------------
 # Local-only dotenv (Render uses environment variables)
@@ -32,23 +42,224 @@ NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "").strip()
 if not NEO4J_PASSWORD:
     raise RuntimeError("NEO4J_PASSWORD is not set")
 
+# pin the target database so the driver skips the home-database lookup per query
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j").strip() or "neo4j"
+
+# connection pool (per uvicorn worker process):
+#   NEO4J_POOL     max pooled connections
+#   NEO4J_ACQ      seconds to wait for a free connection before failing
+#   NEO4J_PREWARM  connections opened at startup so the first requests skip TLS + HELLO
+#   NEO4J_RETRY    seconds execute_query keeps retrying transient/connectivity errors;
+#                  a request only fails (and counts toward the circuit breaker) after it
+NEO4J_POOL = int(os.getenv("NEO4J_POOL", "50"))
+NEO4J_ACQ = float(os.getenv("NEO4J_ACQ", "30"))
+NEO4J_PREWARM = min(int(os.getenv("NEO4J_PREWARM", "10")), NEO4J_POOL)
+NEO4J_RETRY = float(os.getenv("NEO4J_RETRY", "5"))
+
+# ----------------------------
+# Response cache (Redis when REDIS_URL is set, else in-process LRU per worker)
+# ----------------------------
+CACHE_PREFIX = "um:"
+REDIS_URL = os.getenv("REDIS_URL", "").strip()
+redis_client = None
+if REDIS_URL:
+    try:
+        from redis import asyncio as redis_asyncio  # type: ignore
+        redis_client = redis_asyncio.Redis.from_url(REDIS_URL)
+    except Exception:
+        redis_client = None
+
+# shared secret for POST /cache/invalidate; the endpoint is disabled when unset
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN", "").strip()
+
+_LOCAL_CACHE_MAX = 1024
+_local_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+
+async def _cache_get(key: str) -> Optional[Any]:
+    if redis_client is not None:
+        try:
+            v = await redis_client.get(CACHE_PREFIX + key)
+        except Exception:
+            return None
+        return orjson.loads(v) if v is not None else None
+
+    hit = _local_cache.get(key)
+    if hit is None:
+        return None
+    expires_at, value = hit
+    if expires_at < time.monotonic():
+        _local_cache.pop(key, None)
+        return None
+    _local_cache.move_to_end(key)
+    return value
+
+
+async def _cache_set(key: str, value: Any, ttl: int) -> None:
+    if redis_client is not None:
+        try:
+            await redis_client.set(CACHE_PREFIX + key, _dumps(value), ex=ttl)
+        except Exception:
+            pass
+        return
+
+    _local_cache[key] = (time.monotonic() + ttl, value)
+    _local_cache.move_to_end(key)
+    while len(_local_cache) > _LOCAL_CACHE_MAX:
+        _local_cache.popitem(last=False)
+
+
+async def _cache_clear(prefix: str = "") -> int:
+    if redis_client is not None:
+        try:
+            keys = [k async for k in redis_client.scan_iter(match=f"{CACHE_PREFIX}{prefix}*")]
+            if keys:
+                await redis_client.delete(*keys)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"RedisError: {type(e).__name__}: {e}")
+        return len(keys)
+
+    keys = [k for k in _local_cache if k.startswith(prefix)]
+    for k in keys:
+        del _local_cache[k]
+    return len(keys)
+
+
+def _dumps(value: Any) -> bytes:
+    # neo4j temporal/spatial values fall back to their string (ISO) form
+    return orjson.dumps(value, default=str)
+
+
+def _json_response(value: Any) -> Response:
+    # returning a Response makes FastAPI skip jsonable_encoder: orjson does all the work
+    return Response(_dumps(value), media_type="application/json")
+
+
+def cached(
+    key: Callable[..., str],
+    ttl: int,
+    cache_if: Callable[[Any], bool] = lambda value: True,
+):
+    """Cache-aside for endpoints: key(**endpoint_kwargs) -> cache key, ttl in seconds.
+    Results rejected by cache_if (e.g. "not found") are returned but not stored."""
+    def deco(fn: Callable[..., Awaitable[Any]]):
+        @functools.wraps(fn)
+        async def wrapper(**kw):
+            k = key(**kw)
+            hit = await _cache_get(k)
+            if hit is not None:
+                return _json_response(hit)
+            value = await fn(**kw)
+            if cache_if(value):
+                await _cache_set(k, value, ttl)
+            return _json_response(value)
+        return wrapper
+    return deco
+
+
 # ----------------------------
 # FastAPI app + Neo4j driver lifecycle
 # ----------------------------
 driver = None  # set in lifespan
 
+# label-anchored lookups below turn into NodeIndexSeek once these exist
+_INDEXES = (
+    "CREATE RANGE INDEX dice_building_osm_id IF NOT EXISTS FOR (n:dice_Building) ON (n.osm_id)",
+    "CREATE RANGE INDEX dice_building_unit_osm_id IF NOT EXISTS FOR (n:dice_BuildingUnit) ON (n.osm_id)",
+    "CREATE RANGE INDEX dice_building_building_id IF NOT EXISTS FOR (n:dice_Building) ON (n.building_id)",
+    "CREATE RANGE INDEX dicv_quantitative_property_building_type IF NOT EXISTS "
+    "FOR (q:dicv_QuantitativeProperty) ON (q.building_id, q.type)",
+)
+
+
+async def _prewarm_pool() -> None:
+    # concurrent queries force the pool to open NEO4J_PREWARM connections up front
+    await asyncio.gather(
+        *(
+            driver.execute_query(  # type: ignore[attr-defined]
+                "RETURN 1", database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+            )
+            for _ in range(NEO4J_PREWARM)
+        ),
+        return_exceptions=True,
+    )
+
+
+async def _warm_up() -> None:
+    # runs as a background task: with Aura paused/unreachable each call sits in the
+    # driver's retry window, which must never delay startup (and /ping)
+    await _prewarm_pool()
+    await _ensure_indexes()
+    await _warm_query_plans()
+
+
+async def _ensure_indexes() -> None:
+    for stmt in _INDEXES:
+        try:
+            await driver.execute_query(stmt, database_=NEO4J_DATABASE)  # type: ignore[attr-defined]
+        except Exception:
+            # e.g. read-only credentials: the API works without them, just slower
+            pass
+
+
+async def _warm_query_plans() -> None:
+    # EXPLAIN compiles and caches each plan without running it, so the first real
+    # request after a deploy does not pay the planner cost
+    params = {
+        "osm_ids": ["__warm__"],
+        "name": "__warm__",
+        "fields": [],
+        "building_id": "__warm__",
+        "building_ids": ["__warm__"],
+    }
+    for cypher in (
+        _CYPHER_LINKED_OSM,
+        _CYPHER_BUILDING,
+        _CYPHER_COMPONENT,
+        _CYPHER_VOLUME_ALL,
+        _CYPHER_VOLUME_BLDG,
+        _CYPHER_VOLUME_BLDGS,
+    ):
+        try:
+            await driver.execute_query(  # type: ignore[attr-defined]
+                "EXPLAIN " + cypher,
+                parameters_=params,
+                database_=NEO4J_DATABASE,
+                routing_=RoutingControl.READ,
+            )
+        except Exception:
+            pass
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global driver
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    driver = AsyncGraphDatabase.driver(
+        NEO4J_URI,
+        auth=(NEO4J_USER, NEO4J_PASSWORD),
+        max_connection_pool_size=NEO4J_POOL,
+        connection_acquisition_timeout=NEO4J_ACQ,
+        keep_alive=True,
+        max_transaction_retry_time=NEO4J_RETRY,
+    )
+    warm_up = asyncio.create_task(_warm_up())
     try:
         yield
     finally:
+        warm_up.cancel()
+        try:
+            await warm_up
+        except (asyncio.CancelledError, Exception):
+            pass
         try:
-            driver.close()
+            await driver.close()
         except Exception:
             pass
+        if redis_client is not None:
+            try:
+                await redis_client.aclose()
+            except Exception:
+                pass
 
 
 app = FastAPI(lifespan=lifespan)
@@ -67,113 +278,165 @@ app.add_middleware(
         "http://localhost:8000",
     ],
     allow_credentials=False,
-    allow_methods=["GET", "OPTIONS"],
+    allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
 )
 
 # ---------- helpers ----------
-def _run_list(cypher: str, **params) -> List[Dict[str, Any]]:
+class CircuitBreaker:
+    """Fail fast with 503 for `reset_after` seconds once `fail_threshold` consecutive
+    connectivity errors were seen, instead of every request waiting on the Bolt timeout."""
+
+    def __init__(self, fail_threshold: int = 5, reset_after: float = 10.0):
+        self.fail_threshold = fail_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+
+    def check(self) -> None:
+        if self._opened_at is None:
+            return
+        if time.monotonic() - self._opened_at < self.reset_after:
+            raise HTTPException(status_code=503, detail="Neo4j unavailable (circuit open)")
+        # half-open: this caller is the single trial; restarting the window makes
+        # everyone else keep failing fast until the trial reports back
+        self._opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        # _failures stays >= fail_threshold while open, so a failed trial re-opens at once
+        self._failures += 1
+        if self._failures >= self.fail_threshold:
+            self._opened_at = time.monotonic()
+
+
+neo4j_breaker = CircuitBreaker()
+
+MAX_BATCH_IDS = int(os.getenv("MAX_BATCH_IDS", "500"))
+
+
+# every endpoint is a pure read: route to Aura readers. execute_query runs a managed
+# transaction, so transient errors (Neo.TransientError.*) are already retried with jitter.
+def _neo4j_http_error(e: Exception) -> HTTPException:
+    # connectivity errors count toward the breaker; query errors do not
+    if isinstance(e, (ServiceUnavailable, SessionExpired)):
+        neo4j_breaker.record_failure()
+    if isinstance(e, Neo4jError):
+        return HTTPException(status_code=503, detail=f"Neo4jError: {e.code}| {e.message}")
+    return HTTPException(status_code=503, detail=f"Neo4jError: {type(e).__name__}: {e}")
+
+
+async def _execute(cypher: LiteralString, params: Dict[str, Any], **kwargs) -> Any:
+    neo4j_breaker.check()
     try:
-        with driver.session() as s:  # type: ignore[attr-defined]
-            return [r.data() for r in s.run(cypher, **params)]
-    except Neo4jError as e:
-        raise HTTPException(status_code=503, detail=f"Neo4jError: {e.code}| {e.message}")
+        result = await driver.execute_query(  # type: ignore[attr-defined]
+            cypher,
+            parameters_=params,
+            database_=NEO4J_DATABASE,
+            routing_=RoutingControl.READ,
+            **kwargs,
+        )
     except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Neo4jError: {type(e).__name__}: {e}")
+        raise _neo4j_http_error(e)
+    neo4j_breaker.record_success()
+    return result
 
 
-def _run_single(cypher: str, **params) -> Optional[Dict[str, Any]]:
-    try:
-        with driver.session() as s:  # type: ignore[attr-defined]
-            rec = s.run(cypher, **params).single()
-            return rec.data() if rec else None
-    except Neo4jError as e:
-        raise HTTPException(status_code=503, detail=f"Neo4jError: {e.code}| {e.message}")
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Neo4jError: {type(e).__name__}: {e}")
+async def _run_records(cypher: LiteralString, **params) -> List[Record]:
+    # raw records: index them (r[0]) when the row is a few scalars, skipping r.data() dicts
+    records, _, _ = await _execute(cypher, params)
+    return records
 
 
-def _parse_fields(s: Optional[str]) -> List[str]:
-    return [x.strip() for x in (s or "").split(",") if x.strip()]
+async def _run_list(cypher: LiteralString, **params) -> List[Dict[str, Any]]:
+    return [r.data() for r in await _run_records(cypher, **params)]
 
 
-def _pick_props(props: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
-    return {k: props.get(k) for k in fields if k in props} if fields else {}
+async def _run_single(cypher: LiteralString, **params) -> Optional[Dict[str, Any]]:
+    rec = await _execute(cypher, params, result_transformer_=lambda r: r.single(strict=False))
+    return rec.data() if rec else None
 
 
-# ---------- endpoints ----------
-@app.get("/ping")
-def ping():
-    # 不查 Neo4j：只要 FastAPI 存活就 ok
-    return {"status": "ok"}
+def _batch_ids(ids: List[str]) -> List[str]:
+    # duplicates would repeat UNWIND rows (and double aggregates); cap the query size
+    unique = list(dict.fromkeys(ids))
+    if len(unique) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return unique
 
 
-@app.get("/health/neo4j")
-def neo4j_health():
-    try:
-        with driver.session() as s:  # type: ignore[attr-defined]
-            r = s.run("RETURN 1 AS ok").single()
-        return {"ok": True, "neo4j": True, "result": r["ok"]}
-    except Exception as e:
-        return {"ok": False, "neo4j": False, "error": str(e)}
+def _parse_fields(s: Optional[str]) -> List[str]:
+    return [x.strip() for x in (s or "").split(",") if x.strip()]
 
 
-@app.get("/health/neo4j-count")
-def health_neo4j_count():
-    try:
-        with driver.session() as s:  # type: ignore[attr-defined]
-            r = s.run("MATCH (n) RETURN count(n) AS c").single()
-        return {"ok": True, "nodes": r["c"]}
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+# ---------- cypher ----------
+# Queries are constant literals with $params only: interpolating values would defeat
+# Neo4j's query-plan cache (and trips LiteralString checks on the helpers).
+_CYPHER_LINKED_OSM: Final[LiteralString] = """
+    MATCH (n:dice_Building) WHERE n.osm_id IS NOT NULL RETURN n.osm_id AS osm_id
+    UNION
+    MATCH (n:dice_BuildingUnit) WHERE n.osm_id IS NOT NULL RETURN n.osm_id AS osm_id
+"""
+
+# shared by /building and the batched /buildings; one row per matched node, keyed by osm_id
+_CYPHER_BUILDING: Final[LiteralString] = """
+    CALL {
+      MATCH (n:dice_Building) WHERE n.osm_id IN $osm_ids RETURN n
+      UNION
+      MATCH (n:dice_BuildingUnit) WHERE n.osm_id IN $osm_ids RETURN n
+    }
 
+    OPTIONAL MATCH (n)<-[:dicer_hasPart]-(parent:dice_Building)
+    WITH n, parent, coalesce(parent, n) AS mainBuilding
 
-@app.get("/linked_osm_ids")
-def linked_osm_ids():
-    cypher = """
-    MATCH (n)
-    WHERE (n:dice_Building OR n:dice_BuildingUnit) AND n.osm_id IS NOT NULL
-    RETURN DISTINCT n.osm_id AS osm_id
-    """
-    rows = _run_list(cypher)
-    return {"osm_ids": [r["osm_id"] for r in rows if r.get("osm_id")]}
+    // one CALL per fan-out: each aggregates to a single row, so they never cross-join
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:hasProperty]->(bc:dicv_Property)
+      WHERE bc.name STARTS WITH "buildingClass"
+      RETURN head(collect(DISTINCT bc.name)) AS bcName
+    }
 
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:hasRole]->(r:dice_Role)
+      RETURN head(collect(DISTINCT r.name)) AS roleName
+    }
 
-@app.get("/building")
-def get_building(osm_id: str):
-    cypher = """
-    MATCH (n {osm_id: $osm_id})
-    WHERE n:dice_Building OR n:dice_BuildingUnit
+    // structural system from Category(Type="structural_system")
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:isClassifiedBy]->(cat:Category)
+      WHERE cat.Type = "structural_system" AND cat.name IS NOT NULL
+      RETURN head(collect(DISTINCT cat.name)) AS structuralSystem
+    }
 
-    OPTIONAL MATCH (n)<-[:dicer_hasPart]-(parent:dice_Building)
-    WITH n, parent, coalesce(parent, n) AS mainBuilding
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:hasLocation]->(loc)
+      RETURN head(collect(properties(loc))) AS location
+    }
 
-    OPTIONAL MATCH (mainBuilding)-[:hasProperty]->(bc:dicv_Property)
-    WHERE bc.name STARTS WITH "buildingClass"
-    WITH n, parent, mainBuilding, head(collect(DISTINCT bc.name)) AS bcName
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:regulatedBy]->(plan:PlanningDocument)
+      RETURN head(collect(plan {.title, .url, .planNo, .lastModified})) AS planning
+    }
 
-    OPTIONAL MATCH (mainBuilding)-[:hasRole]->(r:dice_Role)
-    WITH n, parent, mainBuilding, bcName, head(collect(DISTINCT r.name)) AS roleName
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:inDistrict]->(dist:District)
+      RETURN head(collect(DISTINCT dist.name)) AS district
+    }
 
-    // structural system from Category(Type="structural_system")
-    OPTIONAL MATCH (mainBuilding)-[:isClassifiedBy]->(cat:Category)
-    WHERE cat.Type = "structural_system" AND cat.name IS NOT NULL
-    WITH n, parent, mainBuilding, bcName, roleName,
-         head(collect(DISTINCT cat.name)) AS structuralSystem
-
-    OPTIONAL MATCH (mainBuilding)-[:hasLocation]->(loc)
-    OPTIONAL MATCH (mainBuilding)-[:regulatedBy]->(plan:PlanningDocument)
-    OPTIONAL MATCH (mainBuilding)-[:inDistrict]->(dist:District)
-    WITH n, parent, mainBuilding, loc, plan, bcName, roleName, structuralSystem,
-         collect(DISTINCT dist.name) AS districtNames
-
-    OPTIONAL MATCH (mainBuilding)-[:dicer_hasPart]->(bo:dice_BuildingObject)
-    WITH n, parent, mainBuilding, loc, plan, bcName, roleName, structuralSystem, districtNames,
-         collect(DISTINCT bo) AS bos
-
-    WITH
-      n, parent, mainBuilding, loc, plan, bcName, roleName, structuralSystem, districtNames,
-      [bo IN bos |
+    CALL {
+      WITH mainBuilding
+      OPTIONAL MATCH (mainBuilding)-[:dicer_hasPart]->(bo:dice_BuildingObject)
+      WITH collect(DISTINCT bo) AS bos
+      RETURN [bo IN bos |
         {
           name:      coalesce(bo.name, bo.id, bo.uuid),
           number:    coalesce(bo.number, 0),
@@ -183,36 +446,174 @@ def get_building(osm_id: str):
           length_mm: bo.length_mm
         }
       ] AS componentInfo
+    }
 
-    WITH
-      n, parent, mainBuilding, loc, plan, bcName, roleName, structuralSystem, districtNames, componentInfo,
-      [ci IN componentInfo | ci.name] AS components,
-      reduce(xs = [], ci IN componentInfo | xs + ci.materials) AS materialsRaw
+    // flatten component materials linearly (reduce(xs + ...) re-copies the accumulator per item)
+    CALL {
+      WITH componentInfo
+      UNWIND componentInfo AS ci
+      UNWIND ci.materials AS mat
+      RETURN collect(mat) AS materialsRaw
+    }
 
-    RETURN {
+    RETURN n.osm_id AS key, {
       found: true,
       propsMain: properties(mainBuilding),
       propsPart: CASE WHEN parent IS NULL OR parent = n THEN null ELSE properties(n) END,
       bcName: bcName,
       roleName: roleName,
       structuralSystem: structuralSystem,
-      location: properties(loc),
-      planning: CASE WHEN plan IS NULL THEN null ELSE {
-        title: plan.title, url: plan.url, planNo: plan.planNo, lastModified: plan.lastModified
-      } END,
+      location: location,
+      planning: planning,
       materials: materialsRaw,
-      components: components,
+      components: [ci IN componentInfo | ci.name],
       componentInfo: componentInfo,
-      district: CASE WHEN size(districtNames) > 0 THEN districtNames[0] ELSE null END
+      district: district
     } AS result
-    """
+"""
 
-    rec = _run_single(cypher, osm_id=osm_id)
-    if not rec or not rec.get("result") or not rec["result"].get("propsMain"):
+_CYPHER_COMPONENT: Final[LiteralString] = """
+    MATCH (b)-[:dicer_hasPart]->(bo:dice_BuildingObject)
+    WHERE (b:dice_Building OR b:dice_BuildingUnit)
+      AND coalesce(bo.name, bo.id, bo.uuid) = $name
+
+    OPTIONAL MATCH (b)<-[:dicer_hasPart]-(parent:dice_Building)
+    WITH bo, coalesce(parent, b) AS mainBuilding
+
+    OPTIONAL MATCH (bo)-[:hasMaterial]->(m:dice_MaterialEntity)
+    OPTIONAL MATCH (bo)-[:isClassifiedBy|hasCategory|dicer_isClassifiedBy]-(c:Category)
+    WITH mainBuilding, bo, collect(DISTINCT m) AS ms, collect(DISTINCT c) AS cs
+
+    RETURN
+      coalesce(mainBuilding.name, mainBuilding.buildingName, mainBuilding.osm_name) AS building,
+      mainBuilding.building_id AS building_id,
+      mainBuilding.osm_id AS osm_id,
+      coalesce(bo.number, bo.properties.count, 0) AS number,
+      bo.width_mm  AS width_mm,
+      bo.length_mm AS length_mm,
+      bo.height_mm AS height_mm,
+      [mm IN ms WHERE mm IS NOT NULL | coalesce(mm.name, mm.id, mm.uuid)] AS materials,
+      [cc IN cs WHERE cc IS NOT NULL | cc.name] AS categories,
+      // only the requested $fields leave the server, as [key, value] pairs
+      [cc IN cs WHERE cc IS NOT NULL | {name: cc.name, props: [k IN $fields WHERE k IN keys(cc) | [k, cc[k]]]}] AS categoryPropsRaw
+    ORDER BY building
+"""
+
+_CYPHER_VOLUME_ALL: Final[LiteralString] = """
+    MATCH (m:dice_MaterialEntity)-[:hasQuantitativeProperty]->(q:dicv_QuantitativeProperty)
+    WHERE q.type = 'Volume' AND q.value_m3 IS NOT NULL
+    RETURN coalesce(m.name, q.material_id) AS material, sum(q.value_m3) AS volume_m3
+    ORDER BY volume_m3 DESC
+"""
+
+_CYPHER_VOLUME_BLDG: Final[LiteralString] = """
+    MATCH (m:dice_MaterialEntity)-[:hasQuantitativeProperty]->(q:dicv_QuantitativeProperty)
+    WHERE q.building_id = $building_id AND q.type = 'Volume' AND q.value_m3 IS NOT NULL
+    RETURN coalesce(m.name, q.material_id) AS material, sum(q.value_m3) AS volume_m3
+    ORDER BY volume_m3 DESC
+"""
+
+_CYPHER_VOLUME_BLDGS: Final[LiteralString] = """
+    UNWIND $building_ids AS bid
+    MATCH (m:dice_MaterialEntity)-[:hasQuantitativeProperty]->(q:dicv_QuantitativeProperty)
+    WHERE q.building_id = bid AND q.type = 'Volume' AND q.value_m3 IS NOT NULL
+    RETURN bid, coalesce(m.name, q.material_id) AS material, sum(q.value_m3) AS volume_m3
+    ORDER BY bid, volume_m3 DESC
+"""
+
+
+# ---------- endpoints ----------
+@app.get("/ping")
+async def ping():
+    # 不查 Neo4j：只要 FastAPI 存活就 ok
+    return {"status": "ok"}
+
+
+@app.get("/health/neo4j")
+async def neo4j_health():
+    try:
+        records, _, _ = await driver.execute_query(  # type: ignore[attr-defined]
+            "RETURN 1 AS ok", database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+        )
+        r = records[0]
+        return {"ok": True, "neo4j": True, "result": r["ok"]}
+    except Exception as e:
+        return {"ok": False, "neo4j": False, "error": str(e)}
+
+
+@app.get("/health/neo4j-count")
+async def health_neo4j_count():
+    try:
+        records, _, _ = await driver.execute_query(  # type: ignore[attr-defined]
+            "MATCH (n) RETURN count(n) AS c", database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+        )
+        r = records[0]
+        return {"ok": True, "nodes": r["c"]}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+@app.get("/linked_osm_ids")
+@cached(key=lambda **kw: "linked_osm_ids", ttl=60)
+async def linked_osm_ids():
+    rows = await _run_records(_CYPHER_LINKED_OSM)
+    return {"osm_ids": [r[0] for r in rows if r[0]]}
+
+
+class _SessionStreamingResponse(StreamingResponse):
+    """StreamingResponse that owns a Neo4j session and always closes it once the
+    response is done, even if the body generator never started (early disconnect)."""
+
+    def __init__(self, content: Any, session: Any, **kwargs):
+        super().__init__(content, **kwargs)
+        self._session = session
+        self._session_closed = False
+
+    async def close_session(self) -> None:
+        if not self._session_closed:
+            self._session_closed = True
+            await self._session.close()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.close_session()
+
+
+@app.get("/linked_osm_ids/stream")
+async def linked_osm_ids_stream():
+    # NDJSON, one osm_id per line straight off the Bolt cursor (constant memory).
+    # The query is started before the response so failures still surface as 503.
+    neo4j_breaker.check()
+    s = driver.session(  # type: ignore[attr-defined]
+        database=NEO4J_DATABASE, default_access_mode=READ_ACCESS
+    )
+    try:
+        res = await s.run(_CYPHER_LINKED_OSM)
+    except Exception as e:
+        await s.close()
+        raise _neo4j_http_error(e)
+    neo4j_breaker.record_success()
+
+    async def gen():
+        try:
+            async for rec in res:
+                v = rec[0]
+                if v:
+                    yield orjson.dumps(v) + b"\n"
+        finally:
+            await response.close_session()
+
+    response = _SessionStreamingResponse(gen(), s, media_type="application/x-ndjson")
+    return response
+
+
+def _shape_building(r: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not r or not r.get("propsMain"):
         return {"found": False}
 
-    r = rec["result"]
-    props = dict(r.get("propsMain") or {})
+    props = r["propsMain"]  # fresh dict from record.data(), safe to extend in place
 
     # normalize buildingClass into int, based on property name "buildingClass3"/"buildingClass5"
     bc_name = (r.get("bcName") or "").strip()
@@ -244,50 +645,49 @@ def get_building(osm_id: str):
     }
 
 
+class BuildingBatchReq(BaseModel):
+    osm_ids: List[str]
+
+
+@app.get("/building")
+@cached(
+    key=lambda **kw: f"building:{kw['osm_id']}",
+    ttl=300,
+    cache_if=lambda v: v.get("found", False),  # new buildings show up without invalidation
+)
+async def get_building(osm_id: str):
+    rec = await _run_single(_CYPHER_BUILDING, osm_ids=[osm_id])
+    return _shape_building(rec.get("result") if rec else None)
+
+
+@app.post("/buildings")
+async def get_buildings(req: BuildingBatchReq):
+    # one round-trip for a page of buildings instead of N GET /building calls
+    ids = _batch_ids(req.osm_ids)
+    rows = await _run_list(_CYPHER_BUILDING, osm_ids=ids)
+    found: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        found.setdefault(row["key"], row["result"])  # first row wins, like .single()
+    return _json_response({osm_id: _shape_building(found.get(osm_id)) for osm_id in ids})
+
+
 @app.get("/component-info")
-def component_info(
+async def component_info(
     name: str,
     cat_fields: Optional[str] = Query(default=None, description="Comma-separated Category fields to return"),
 ):
     fields = _parse_fields(cat_fields)
 
-    cypher = """
-    MATCH (b)-[:dicer_hasPart]->(bo:dice_BuildingObject)
-    WHERE (b:dice_Building OR b:dice_BuildingUnit)
-      AND coalesce(bo.name, bo.id, bo.uuid) = $name
-
-    OPTIONAL MATCH (b)<-[:dicer_hasPart]-(parent:dice_Building)
-    WITH bo, coalesce(parent, b) AS mainBuilding
-
-    OPTIONAL MATCH (bo)-[:hasMaterial]->(m:dice_MaterialEntity)
-    OPTIONAL MATCH (bo)-[:isClassifiedBy|hasCategory|dicer_isClassifiedBy]-(c:Category)
-    WITH mainBuilding, bo, collect(DISTINCT m) AS ms, collect(DISTINCT c) AS cs
-
-    RETURN
-      coalesce(mainBuilding.name, mainBuilding.buildingName, mainBuilding.osm_name) AS building,
-      mainBuilding.building_id AS building_id,
-      mainBuilding.osm_id AS osm_id,
-      coalesce(bo.number, bo.properties.count, 0) AS number,
-      bo.width_mm  AS width_mm,
-      bo.length_mm AS length_mm,
-      bo.height_mm AS height_mm,
-      [mm IN ms WHERE mm IS NOT NULL | coalesce(mm.name, mm.id, mm.uuid)] AS materials,
-      [cc IN cs WHERE cc IS NOT NULL | cc.name] AS categories,
-      [cc IN cs WHERE cc IS NOT NULL | {name: cc.name, props: properties(cc)}] AS categoryPropsRaw
-    ORDER BY building
-    """
-
-    rows = _run_list(cypher, name=name)
+    rows = await _run_list(_CYPHER_COMPONENT, name=name, fields=fields)
     out: List[Dict[str, Any]] = []
 
     for r in rows:
-        cat_props: List[Dict[str, Any]] = []
-        for item in (r.get("categoryPropsRaw") or []):
-            if not item or not item.get("name"):
-                continue
-            payload = {"name": item["name"]}
-            payload.update(_pick_props(item.get("props") or {}, fields))
-            cat_props.append(payload)
+        # categoryProps is only returned when fields were requested: don't build it otherwise
+        cat_props: List[Dict[str, Any]] = [
+            {"name": item["name"], **dict(item["props"])}
+            for item in (r.get("categoryPropsRaw") or [])
+            if item and item.get("name")
+        ] if fields else []
 
         out.append(
             {
@@ -297,35 +697,61 @@ def component_info(
                 "number": r.get("number") or 0,
                 "materials": r.get("materials") or [],
                 "categories": r.get("categories") or [],
-                "categoryProps": cat_props if fields else [],
+                "categoryProps": cat_props,
                 "width_mm": r.get("width_mm"),
                 "length_mm": r.get("length_mm"),
                 "height_mm": r.get("height_mm"),
             }
         )
 
-    return out
+    return _json_response(out)
 
 
 @app.get("/material-volume-all")
-def material_volume_all():
-    cypher = """
-    MATCH (m:dice_MaterialEntity)-[:hasQuantitativeProperty]->(q:dicv_QuantitativeProperty)
-    WHERE q.type = 'Volume' AND q.value_m3 IS NOT NULL
-    RETURN coalesce(m.name, q.material_id) AS material, sum(q.value_m3) AS volume_m3
-    ORDER BY volume_m3 DESC
-    """
-    rows = _run_list(cypher)
-    return [{"material": r["material"], "volume_m3": r["volume_m3"]} for r in rows]
+@cached(key=lambda **kw: "material_volume_all", ttl=60)
+async def material_volume_all():
+    rows = await _run_records(_CYPHER_VOLUME_ALL)
+    return [{"material": r[0], "volume_m3": r[1]} for r in rows]
 
 
 @app.get("/material-volume-building")
-def material_volume_building(building_id: str):
-    cypher = """
-    MATCH (m:dice_MaterialEntity)-[:hasQuantitativeProperty]->(q:dicv_QuantitativeProperty)
-    WHERE q.type = 'Volume' AND q.building_id = $building_id AND q.value_m3 IS NOT NULL
-    RETURN coalesce(m.name, q.material_id) AS material, sum(q.value_m3) AS volume_m3
-    ORDER BY volume_m3 DESC
-    """
-    rows = _run_list(cypher, building_id=building_id)
-    return [{"material": r["material"], "volume_m3": r["volume_m3"]} for r in rows]
+@cached(key=lambda **kw: f"material_volume_building:{kw['building_id']}", ttl=60)
+async def material_volume_building(building_id: str):
+    rows = await _run_records(_CYPHER_VOLUME_BLDG, building_id=building_id)
+    return [{"material": r[0], "volume_m3": r[1]} for r in rows]
+
+
+class VolumeBatchReq(BaseModel):
+    building_ids: List[str]
+
+
+@app.post("/material-volume-buildings")
+async def material_volume_buildings(req: VolumeBatchReq):
+    # K buildings in one UNWIND query; rows arrive grouped by bid, largest volume first
+    ids = _batch_ids(req.building_ids)
+    rows = await _run_records(_CYPHER_VOLUME_BLDGS, building_ids=ids)
+    out: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for r in rows:
+        out[r[0]].append({"material": r[1], "volume_m3": r[2]})
+    return _json_response({bid: out.get(bid, []) for bid in ids})
+
+
+@app.post("/cache/invalidate")
+async def cache_invalidate(prefix: str = "", x_cache_token: str = Header(default="")):
+    # call after writing to the graph; prefix e.g. "building:" limits what is dropped.
+    # Disabled unless CACHE_ADMIN_TOKEN is set; callers send it as X-Cache-Token.
+    if not CACHE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_cache_token.encode(), CACHE_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid cache token")
+
+    invalidated = await _cache_clear(prefix)
+    if redis_client is not None:
+        return {"ok": True, "invalidated": invalidated, "scope": "redis"}
+    # in-process LRU: other uvicorn workers keep their own entries until TTL expiry
+    return {
+        "ok": True,
+        "invalidated": invalidated,
+        "scope": "worker",
+        "note": "in-process cache: only this worker was cleared; others expire by TTL",
+    }
@@ -1,7 +1,13 @@
+import os
+import hashlib
+
+import aiofiles
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from urllib.parse import quote
 from uuid import uuid4
 
 # ====== 目录初始化 ======
@@ -11,6 +17,77 @@ MODEL_ROOT.mkdir(exist_ok=True)
 RAW_DIR = MODEL_ROOT / "raw"
 RAW_DIR.mkdir(exist_ok=True)
 
+# 上传先写临时文件：放在 MODEL_ROOT 之外（不会被 /files 暴露），
+# 但与 RAW_DIR 同一文件系统，os.replace 为原子操作
+TMP_DIR = Path(".upload_tmp")
+TMP_DIR.mkdir(exist_ok=True)
+
+# ====== 上传限制 ======
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK = 1 << 20  # 1 MiB per read/write
+UPLOAD_BODY_SLACK = 64 * 1024  # multipart 边界/表单头的余量
+
+
+class UploadLimitMiddleware:
+    """
+    在表单解析（落盘到临时文件）之前限制上传请求体大小：
+    先看 Content-Length，再对实际收到的字节计数（chunked 上传没有 Content-Length）
+    """
+
+    def __init__(self, app, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send):
+        body = b'{"detail":"File too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+        too_large = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # 让下游按客户端断开处理，停止继续读取/写盘
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal responded
+            if too_large:
+                # 下游因“断开”给出的错误响应替换为 413
+                if not responded:
+                    responded = True
+                    await self._reject(send)
+                return
+            responded = True
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+        if too_large and not responded:
+            await self._reject(send)
+
 # ====== FastAPI init ======
 app = FastAPI(title="Simple Model Library")
 
@@ -21,8 +98,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    UploadLimitMiddleware,
+    path="/raw/upload",
+    max_bytes=MAX_UPLOAD_BYTES + UPLOAD_BODY_SLACK,
+)
+
 # 前端用 /files/... 访问模型文件
-app.mount("/files", StaticFiles(directory=str(MODEL_ROOT)), name="files")
+# 部署在 nginx 后面时设置 FILES_ACCEL_PREFIX（如 /internal/files/），由 nginx sendfile 直接发文件：
+#   location /internal/files/ { internal; alias /app/models/; }
+FILES_ACCEL_PREFIX = os.getenv("FILES_ACCEL_PREFIX", "").strip()
+
+if FILES_ACCEL_PREFIX:
+    @app.api_route("/files/{rel_path:path}", methods=["GET", "HEAD"])
+    def files_accel(rel_path: str):
+        parts = Path(rel_path).parts
+        if not parts or Path(rel_path).is_absolute() or any(p.startswith(".") for p in parts):
+            raise HTTPException(status_code=404, detail="File not found")
+        if not (MODEL_ROOT / rel_path).is_file():
+            raise HTTPException(status_code=404, detail="File not found")
+        # 响应头只能是 latin-1：非 ASCII 文件名需 URL 编码（nginx 会解码）
+        return Response(headers={"X-Accel-Redirect": FILES_ACCEL_PREFIX.rstrip("/") + "/" + quote(rel_path)})
+else:
+    app.mount("/files", StaticFiles(directory=str(MODEL_ROOT)), name="files")
 
 # ====== ping ======
 @app.get("/ping")
@@ -33,18 +131,50 @@ def ping():
 # ====== 上传文件 ======
 @app.post("/raw/upload")
 async def raw_upload(file: UploadFile = File(...)):
-    """上传文件到 models/raw/，返回可下载的 file_url"""
+    """
+    上传文件到 models/raw/，返回可下载的 file_url
+    文件按内容 sha256 命名：相同内容的多次上传共用同一个文件（deduplicated=true），
+    任何一方调用 /raw/delete 都会让所有上传者拿到的 file_url 失效
+    """
     if not file.filename:
         raise HTTPException(400, "Empty filename")
 
     suffix = Path(file.filename).suffix or ""
-    model_id = uuid4().hex
+    tmp_path = TMP_DIR / (uuid4().hex + ".part")
+
+    # 分块写入：内存占用只有一个 chunk，写盘不阻塞事件循环；边写边算 sha256
+    h = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    break
+                h.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        # 上传中断/取消时不留下孤立的 .part 文件
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    # 兜底：请求体的限制由 UploadLimitMiddleware 在解析表单前完成，这里只拦截余量内的超限文件
+    if size > MAX_UPLOAD_BYTES:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(413, "File too large")
+
+    # 以内容哈希命名：重复上传同一文件时直接复用已有文件
+    model_id = h.hexdigest()
     stored_name = model_id + suffix
     fpath = RAW_DIR / stored_name
-
-    content = await file.read()
-    with open(fpath, "wb") as f:
-        f.write(content)
+    deduplicated = fpath.exists()
+    if deduplicated:
+        tmp_path.unlink(missing_ok=True)
+    else:
+        os.replace(tmp_path, fpath)
 
     file_url = f"/files/raw/{stored_name}"
 
@@ -53,7 +183,10 @@ async def raw_upload(file: UploadFile = File(...)):
         "model_id": model_id,
         "original_name": file.filename,
         "file_url": file_url,
-        "file_size": len(content),
+        "file_size": size,
+        "deduplicated": deduplicated,
+        **({"note": "identical content already stored: this file_url is shared, "
+                    "deleting it affects every upload of the same file"} if deduplicated else {}),
     }
 
 
@@ -61,16 +194,18 @@ async def raw_upload(file: UploadFile = File(...)):
 @app.get("/raw/list")
 def raw_list():
     """列出 models/raw 下所有文件，包含下载用的 file_url"""
-    files = []
-    for p in sorted(RAW_DIR.glob("*")):
-        if p.is_file():
-            rel = p.relative_to(MODEL_ROOT)  # raw/xxxxx.glb
-            files.append({
-                "name": p.name,                         # 文件名
-                "file_url": f"/files/{rel.as_posix()}", # 前端可访问的 URL
-                "size": p.stat().st_size,
-            })
-    return files
+    # scandir 的 DirEntry 自带类型/stat 缓存，每个文件只需一次 stat
+    with os.scandir(RAW_DIR) as it:
+        entries = [(e.name, e.stat().st_size) for e in it if e.is_file()]
+    entries.sort()
+    return [
+        {
+            "name": name,                         # 文件名
+            "file_url": f"/files/raw/{name}",     # 前端可访问的 URL
+            "size": size,
+        }
+        for name, size in entries
+    ]
 
 
 # ====== 删除文件（重要） ======
@@ -78,6 +213,7 @@ def raw_list():
 def delete_raw_file(filename: str):
     """
     通过文件名删除 models/raw/ 下的文件
+    注意：文件按内容哈希去重，同内容的所有上传共用此文件，删除后它们的 file_url 均失效
     """
     target = RAW_DIR / filename
 